@@ -1,10 +1,13 @@
+import os
 import sys
 import time
+import functools
 import importlib
 import inspect
+import weakref
 import webbrowser
 from types import ModuleType
-from typing import TypeVar, List, _GenericAlias
+from typing import TypeVar, List, Optional, _GenericAlias
 from pathlib import Path
 from collections import deque
 from textwrap import dedent
@@ -14,41 +17,85 @@ from tempfile import NamedTemporaryFile
 T = TypeVar('T')
 
 
-def introspect(obj: T, queue: deque) -> None:
-    for attr in obj.__dict__.values():
-        if hasattr(attr, '__dock__'):
-            queue.append(attr)
+@functools.lru_cache(maxsize=None)
+def get_source(ref: T) -> Optional[str]:
+    "Caches the source since getsource() re-reads the file on every call"
+    try:
+        return inspect.getsource(ref)
+    except (OSError, TypeError):  # C extensions, REPL/exec'd definitions
+        return None
 
-        if isinstance(attr, type):
-            introspect(attr, queue)
 
+@functools.lru_cache(maxsize=None)
+def get_dedented(text: str) -> str:
+    "Caches dedent() results since docstrings repeat across re-exports"
+    return dedent(text)
 
-def get_modules(path: Path) -> List[str]:
-    modules = []
 
-    if path.is_dir():
-        for entry in path.iterdir():
-            modules.extend(get_modules(entry))
+def introspect(obj: T, queue: List[T], visited: Optional[set] = None) -> None:
+    if visited is None:
+        visited = set()
+
+    stack = deque([obj])
+
+    while stack:
+        current = stack.pop()
+
+        for attr in current.__dict__.values():
+            # Cheaper than hasattr(), which has to catch AttributeError
+            if getattr(attr, '__dock__', None) is not None:
+                queue.append(attr)
 
+            # id() keys avoid hashing arbitrary (possibly unhashable) objects
+            if isinstance(attr, type) and id(attr) not in visited:
+                visited.add(id(attr))
+                stack.append(attr)
+
+
+def scan_modules(path: str):
+    "Yields each .py file below path, reusing the stats scandir() caches"
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from scan_modules(entry.path)
+            elif entry.name.endswith('.py'):
+                yield entry.path
+
+
+def get_modules(path: Path) -> List[str]:
+    if path.is_dir():
+        files = scan_modules(str(path))
     elif path.suffix == '.py':
-        mod = '.'.join([*path.parts][:-1] + [path.stem])
-        modules.append(mod)
+        files = [str(path)]
+    else:
+        files = []
+
+    modules = [
+        os.path.normpath(filename)[:-len('.py')].replace(os.sep, '.')
+        for filename in files
+    ]
+
+    # Ensures that packages (__init__.py) are imported prior to their modules.
+    # Decorate-sort-undecorate so each name is scanned once, not per compare.
+    decorated = [
+        (name.count('.') - name.endswith('.__init__'), name)
+        for name in modules
+    ]
+    decorated.sort()
+
+    return [name for _, name in decorated]
 
-    # Ensures that packages (__init__.py) are imported prior to their modules
-    modules.sort(
-        key=lambda x: x.count('.') - 0.1 if '__init__' in x else x.count('.')
-    )
 
-    return modules
+def cached_import(module: str) -> ModuleType:
+    "Peeks sys.modules first to skip finder traversal on re-imports"
+    mod = sys.modules.get(module)
+    return mod if mod is not None else importlib.import_module(module)
 
 
-def introspect_modules(modules: List[T], queue: deque) -> None:
+def introspect_modules(modules: List[str], queue: List[T]) -> None:
     for module in modules:
         try:
-            mod = importlib.import_module(module)
-
-            # Allows other modules to import this module
-            sys.modules[module] = mod
+            mod = cached_import(module)
 
             queue.append(mod)  # Preserve output order
 
@@ -57,9 +104,17 @@ def introspect_modules(modules: List[T], queue: deque) -> None:
             print('WARNING: Failed to import', module, ':', e)
 
 
+ABSOLUTE_NAME_CACHE = weakref.WeakKeyDictionary()
+
+
 def get_absolute_name(obj: T) -> str:
     "Used to create interlinks"
 
+    try:  # Weakly cached since objects are introspected many times
+        return ABSOLUTE_NAME_CACHE[obj]
+    except (KeyError, TypeError):
+        pass
+
     if not hasattr(obj, '__name__') and isinstance(obj, _GenericAlias):
         name = repr(obj)
     else:
@@ -77,6 +132,11 @@ def get_absolute_name(obj: T) -> str:
     else:  # Methods or Functions
         absolute_name = f'{MODULE.replace(".__init__", "")}.{full_name}'
 
+    try:
+        ABSOLUTE_NAME_CACHE[obj] = absolute_name
+    except TypeError:  # Not every object supports weak references
+        pass
+
     return absolute_name
 
 
@@ -86,9 +146,10 @@ def group(obj: T, root) -> None:
     namespace_parts = fully_qualified_name.split('.')
     first_name = namespace_parts.pop(-1)
 
+    # Walk the nested dicts directly rather than paying a method call per level
     namespace = root
     for each_name in namespace_parts:
-        namespace = namespace.get(each_name)
+        namespace = namespace.namespace[each_name]
 
     if isinstance(obj, ModuleType) and name.endswith('__init__'):  # Package
         type_to_register = Package(first_name, obj, fully_qualified_name)
@@ -115,6 +176,8 @@ class Namespace:
         self.namespace = {}
         self.ref = obj
         self.name_db = {}
+        self.type_tag = type(self).__name__
+        self.interlink_suffix = f'{self.type_tag}-{absolute_name}'
 
     def register_type(self, type_name, type_class):
         self.name_db[type_name] = type_class
@@ -128,34 +191,51 @@ class Namespace:
     def get(self, name):
         return self.namespace[name]
 
+    def walk(self):
+        "Yields ((name, ...), node) pairs without building nested dicts"
+        stack = deque([((self.name,), self)])
+
+        while stack:
+            path, namespace = stack.popleft()
+            yield path, namespace
+
+            for name, value in namespace.namespace.items():
+                if isinstance(value, Namespace):
+                    stack.append((path + (name,), value))
+                else:
+                    yield path + (name,), value
+
     def as_dict(self):
         result = {'__dock_self__': str(self.ref)}
-        for name, value in self.namespace.items():
-            if isinstance(value, Namespace):
-                result[name] = value.as_dict()
-            else:
-                result[name] = str(value)
+        stack = deque([(self, result)])
+
+        while stack:
+            namespace, table = stack.popleft()
+
+            for name, value in namespace.namespace.items():
+                if isinstance(value, Namespace):
+                    table[name] = child = {'__dock_self__': str(value.ref)}
+                    stack.append((value, child))
+                else:
+                    table[name] = str(value)
+
         return result
 
     def get_funcs(self):
         return [
-            *filter(
-                lambda item: isinstance(item, Function),
-                self.namespace.values()
-            )
+            item for item in self.namespace.values()
+            if isinstance(item, Function)
         ]
 
     def get_namespaces(self):
-        classes = Namespace, Package, Module, Class
+        # Package, Module, and Class all subclass Namespace
         return [
-            *filter(
-                lambda item: isinstance(item, classes),
-                self.namespace.values()
-            )
+            item for item in self.namespace.values()
+            if isinstance(item, Namespace)
         ]
 
-    def generate(self, name_db, out):
-        print(self.header(), **out)
+    def generate(self, interlinks, out):
+        out.append(self.header() + '\n')
 
 
 class Package(Namespace):
@@ -163,14 +243,14 @@ class Package(Namespace):
         return f'<PACKAGE {self.name}>'
 
     def header(self):
-        return f'# Package `{get_absolute_name(self.ref)}`'
+        return f'# Package `{self.absolute_name}`'
 
-    def generate(self, name_db, out):
-        print(self.header(), '\n', **out)
+    def generate(self, interlinks, out):
+        out.append(self.header() + ' \n\n')
 
         # Long description
         if self.ref.__doc__:
-            print(dedent(self.ref.__doc__), **out)
+            out.append(get_dedented(self.ref.__doc__) + '\n')
 
 
 class Module(Namespace):
@@ -178,20 +258,20 @@ class Module(Namespace):
         return f'<MODULE {self.name}>'
 
     def header(self):
-        return f'## Module `{get_absolute_name(self.ref)}`'
+        return f'## Module `{self.absolute_name}`'
 
-    def generate(self, name_db, out):
-        print(self.header(), '\n', **out)
+    def generate(self, interlinks, out):
+        out.append(self.header() + ' \n\n')
 
         # Long description
         if self.ref.__doc__:
-            print(dedent(self.ref.__doc__), **out)
+            out.append(get_dedented(self.ref.__doc__) + '\n')
 
         # Output interlinks for each inner object
         for obj in self.namespace.values():
-            absolue = obj.absolute_name
-            type_name = obj.__class__.__name__
-            print(f'- {type_name} [{obj.name}](#{type_name}-{absolue})', **out)
+            out.append(
+                f'- {obj.type_tag} [{obj.name}](#{obj.interlink_suffix})\n'
+            )
 
 
 class Class(Namespace):
@@ -199,20 +279,20 @@ class Class(Namespace):
         return f'<CLASS {self.name}>'
 
     def header(self):
-        return f'### Class `{get_absolute_name(self.ref)}`'
+        return f'### Class `{self.absolute_name}`'
 
-    def generate(self, name_db, out):
-        print(self.header(), **out)
+    def generate(self, interlinks, out):
+        out.append(self.header() + '\n')
 
         if self.ref.__dock__['fields']:
-            print('**Fields**\n', **out)
+            out.append('**Fields**\n\n')
 
             for field, desc in self.ref.__dock__['fields'].items():
-                print(f'- `{field}`: *{desc}*', **out)
+                out.append(f'- `{field}`: *{desc}*\n')
 
         # Long description
         if self.ref.__doc__:
-            print(dedent(self.ref.__doc__), **out)
+            out.append(get_dedented(self.ref.__doc__) + '\n')
 
         # TODO(pebaz): Print out class heirarchy using MRO if it seems useful
 
@@ -222,99 +302,92 @@ class Function:
         self.name = name
         self.absolute_name = absolute_name
         self.ref = obj
+        self.type_tag = type(self).__name__
+        self.interlink_suffix = f'{self.type_tag}-{absolute_name}'
 
     def __str__(self):
         return f'<FUNCTION {self.name}>'
 
     def header(self):
-        return f'#### Function `{get_absolute_name(self.ref)}`'
+        return f'#### Function `{self.absolute_name}`'
 
-    def generate(self, name_db, out):
-        print(self.header(), '\n', **out)
+    def generate(self, interlinks, out):
+        out.append(self.header() + ' \n\n')
 
         # Short description
         if self.ref.__dock__.get('short'):
-            print(f'> {self.ref.__dock__["short"]}\n', **out)
+            out.append(f'> {self.ref.__dock__["short"]}\n\n')
 
         # Argument Types
         ann = getattr(self.ref, '__annotations__', {})
         if ann:
-            print('**Arguments**\n', **out)
+            out.append('**Arguments**\n\n')
 
-            output = {
-                k: [get_absolute_name(v) if v else '?', '']
-                for k, v in ann.items()
-            }
+            descriptions = self.ref.__dock__['arguments']
+            return_type = None
 
-            for argument, desc in self.ref.__dock__['arguments'].items():
-                output[argument][1] = f'*{desc}*'
+            for argument, annotation in ann.items():
+                type_ = get_absolute_name(annotation) if annotation else '?'
 
-            for argument, (type_, desc) in output.items():
                 if argument == 'return':
+                    return_type = type_
                     continue
 
-                if type_ in name_db:  # Output interlink instead
-                    type_name = name_db[type_].__class__.__name__
-                    interlink = f'[{type_}](#{type_name}-{type_})'
-                    print(f'- `{argument}` -> {interlink}: {desc}', **out)
+                desc = descriptions.get(argument)
+                desc = f'*{desc}*' if desc is not None else ''
+
+                interlink = interlinks.get(type_)
+
+                if interlink is not None:  # Output interlink instead
+                    out.append(f'- `{argument}` -> {interlink}: {desc}\n')
                 else:
-                    print(f'- `{argument}` -> `{type_}`: {desc}', **out)
+                    out.append(f'- `{argument}` -> `{type_}`: {desc}\n')
 
-            print('\n', **out)
+            out.append('\n\n')
 
             # Return Type
-            for argument, (type_, desc) in output.items():
-                if argument == 'return':
-                    print(f'**Return Type:** `{type_}`', **out)
+            if return_type is not None:
+                out.append(f'**Return Type:** `{return_type}`\n')
 
-        print('\n', **out)
+        out.append('\n\n')
 
         # Long description
         if self.ref.__doc__:
-            print(dedent(self.ref.__doc__), **out)
+            out.append(get_dedented(self.ref.__doc__) + '\n')
 
-        print('\n', **out)
+        out.append('\n\n')
 
         # Other sections
         for section_name, section in self.ref.__dock__['sections'].items():
-            print(f'\n**{section_name}**\n', **out)
-            print(dedent(section), **out)
+            out.append(f'\n**{section_name}**\n\n')
+            out.append(get_dedented(section) + '\n')
 
-        print('\n', **out)
+        out.append('\n\n')
 
         # Source code
-        print('<details><summary>Source</summary>', **out)
-        print('\n```python', **out)
-        print(dedent(inspect.getsource(self.ref)), **out)
-        print('```\n', **out)
-        print('</details>\n', **out)
+        source = get_source(self.ref)
+        if source is not None:
+            out.append('<details><summary>Source</summary>\n')
+            out.append('\n```python\n')
+            out.append(get_dedented(source) + '\n')
+            out.append('```\n\n')
+            out.append('</details>\n\n')
 
 
-def generate_namespace(namespace, name_db, file=None):
-    out = {'file': file} if file else {}
-
+def generate_namespace(namespace, interlinks, out):
     for func in namespace.get_funcs():
-        func.generate(name_db, out)
+        func.generate(interlinks, out)
 
     for item in namespace.get_namespaces():
-        item.generate(name_db, out)
-        generate_namespace(item, name_db, file)
-
+        item.generate(interlinks, out)
+        generate_namespace(item, interlinks, out)
 
-class MarkdeepStyles:
-    __header = r'<link rel="stylesheet" href="https://casual-effects.com/markdeep/latest/{}.css?">'  # noqa: E501
-    DEFAULT = ''
-    JOURNAL = __header.format('journal')
-    APIDOC = __header.format('apidoc')
-    SLATE = __header.format('slate')
-    NEWSMAG = __header.format('newsmag')
-    WEBSITE = __header.format('website')
-    LATEX = __header.format('latex')
-    DARK = __header.format('dark')
-    SLIDES = __header.format('slides')
 
+# Other styles: default (empty), apidoc, slate, newsmag, website, latex,
+# dark, slides
+MARKDEEP_STYLE = r'<link rel="stylesheet" href="https://casual-effects.com/markdeep/latest/{}.css?">'  # noqa: E501
 
-MARKDEEP_HEADER = MarkdeepStyles.JOURNAL
+MARKDEEP_HEADER = MARKDEEP_STYLE.format('journal')
 MARKDEEP_FOOTER = r'<!-- Markdeep: --><style class="fallback">body{visibility:hidden;white-space:pre;font-family:monospace}</style><script src="markdeep.min.js" charset="utf-8"></script><script src="https://morgan3d.github.io/markdeep/latest/markdeep.min.js" charset="utf-8"></script><script>window.alreadyProcessedMarkdeep||(document.body.style.visibility="visible")</script>'  # noqa: E501
 
 
@@ -334,33 +407,41 @@ def cli(args):
     # ! THIS IS VITALLY IMPORTANT (prevents site-packages preferal)
     sys.path.insert(0, str(Path().resolve()))
 
-    queue = deque()
+    queue = []
     modules = get_modules(given_path)
     introspect_modules(modules, queue)
     root = Namespace('root', None, '')
 
     # * This section removes duplicates created by promoting objects from
-    # * modules into `__init__.py`s. By traversing in reverse order and hashing,
-    # * each package/module/class/function will be added once.
-    seen = set(queue)
-    reordered = deque()
+    # * modules into `__init__.py`s. Walking in reverse and keeping only the
+    # * first hit per name means the last definition of each name wins.
+    last_defined = {}
     for each in reversed(queue):
-        if each.__name__ not in seen:
-            reordered.appendleft(each)
-            seen.add(each.__name__)
+        last_defined.setdefault(each.__name__, each)
 
-    while reordered:
-        item = reordered.popleft()
+    for item in reversed(last_defined.values()):
         group(item, root)
 
+    # 1 MiB buffer so even large documents flush in a single write()
     if only_show:
-        output_file = NamedTemporaryFile('w', delete=False, suffix='.html')
+        output_file = NamedTemporaryFile(
+            'w', delete=False, suffix='.html', buffering=1 << 20
+        )
     else:
-        output_file = open(f'{given_path.stem}.md.html', 'w')
+        output_file = open(f'{given_path.stem}.md.html', 'w', buffering=1 << 20)
+
+    # An interlink renders identically everywhere, so build each one once
+    interlinks = {
+        absolute: f'[{absolute}](#{registered.interlink_suffix})'
+        for absolute, registered in root.name_db.items()
+    }
+
+    # Collect every markdown fragment and coalesce into a single write
+    out = [MARKDEEP_HEADER]
+    generate_namespace(root, interlinks, out)
+    out.append(MARKDEEP_FOOTER)
 
-    output_file.write(MARKDEEP_HEADER)
-    generate_namespace(root, root.name_db, output_file)
-    output_file.write(MARKDEEP_FOOTER)
+    output_file.write(''.join(out))
     output_file.close()
 
     if only_show: